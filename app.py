@@ -17,8 +17,6 @@ if os.getenv("LANGCHAIN_API_KEY"):
     os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
 
 import streamlit as st
-from vectorstore import VectorStore
-from rag_chain import RAGChain
 
 
 # 페이지 설정
@@ -32,14 +30,31 @@ st.set_page_config(
 @st.cache_resource
 def load_rag_system():
     """RAG 시스템 로드 (캐싱)"""
+    # 무거운 모듈(torch, chromadb, faiss, openai)은 캐시된 이 함수 안에서만 임포트
+    from vectorstore import VectorStore
+    from rag_chain import RAGChain
+
     vectorstore = VectorStore(
         collection_name="legal_documents",
-        persist_dir="chroma_db"
+        persist_dir="chroma_db",
+        optimize_model=True
     )
+    # 첫 질문 전에 임베딩 모델 컴파일/초기화
+    vectorstore.warmup()
     rag_chain = RAGChain(vectorstore)
     return rag_chain
 
 
+def format_sources(sources: list, with_similarity: bool = False) -> str:
+    """참고 문서 목록을 마크다운 한 덩어리로 변환"""
+    if with_similarity:
+        return "\n".join(
+            f"- **[{src['type']}]** {src['doc_id']} (유사도: {1 - src['distance']:.2%})"
+            for src in sources
+        )
+    return "\n".join(f"- **[{src['type']}]** {src['doc_id']}" for src in sources)
+
+
 def main():
     # 헤더
     st.title("⚖️ Justi-Q 형사법 AI")
@@ -49,7 +64,7 @@ def main():
     # 사이드바
     with st.sidebar:
         st.header("설정")
-        n_results = st.slider("검색 문서 수", min_value=3, max_value=10, value=5)
+        n_results = st.slider("검색 문서 수", min_value=1, max_value=10, value=3)
 
         st.divider()
         st.header("정보")
@@ -85,14 +100,13 @@ def main():
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
-    # 이전 메시지 표시
+    # 이전 메시지 표시 (참고 문서는 저장 시 만들어 둔 마크다운을 한 번에 출력)
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
-            if "sources" in message:
+            if "sources_md" in message:
                 with st.expander("📚 참고 문서"):
-                    for src in message["sources"]:
-                        st.markdown(f"- **[{src['type']}]** {src['doc_id']}")
+                    st.markdown(message["sources_md"])
 
     # 사용자 입력
     if prompt := st.chat_input("형사법 관련 질문을 입력하세요..."):
@@ -103,21 +117,22 @@ def main():
 
         # AI 응답 생성
         with st.chat_message("assistant"):
-            with st.spinner("답변 생성 중..."):
-                result = rag.query(prompt, n_results=n_results)
+            with st.spinner("관련 문서 검색 중..."):
+                result = rag.query_stream(prompt, n_results=n_results)
 
-            st.markdown(result["answer"])
+            # 토큰이 도착하는 대로 출력
+            answer = st.write_stream(result["answer_stream"])
 
             # 참고 문서 표시
             with st.expander("📚 참고 문서"):
-                for src in result["sources"]:
-                    st.markdown(f"- **[{src['type']}]** {src['doc_id']} (유사도: {1 - src['distance']:.2%})")
+                st.markdown(format_sources(result["sources"], with_similarity=True))
 
         # 어시스턴트 메시지 저장
         st.session_state.messages.append({
             "role": "assistant",
-            "content": result["answer"],
-            "sources": result["sources"]
+            "content": answer,
+            "sources": result["sources"],
+            "sources_md": format_sources(result["sources"])
         })
 
 
@@ -6,9 +6,9 @@ Justi-Q: 형사법 RAG 시스템
 import sys
 sys.path.append("src")
 
+# VectorStore/RAGChain(torch, chromadb 등)는 사용하는 메서드 안에서 임포트
+# (spawn/forkserver 방식의 CSV 파싱 워커가 __main__을 다시 임포트할 때 무거운 모듈을 로드하지 않도록)
 from data_loader import LegalDataLoader
-from vectorstore import VectorStore
-from rag_chain import RAGChain
 
 
 class JustiQ:
@@ -52,14 +52,17 @@ class JustiQ:
         print("데이터 인덱싱 시작")
         print("=" * 60)
 
+        from vectorstore import VectorStore
+
         # 데이터 로드 및 청킹
         self.loader = LegalDataLoader(self.data_dir)
         chunks = self.loader.load_and_chunk(chunk_size=chunk_size, overlap=overlap)
 
-        # 벡터 스토어 생성 및 저장
+        # 벡터 스토어 생성 및 저장 (문서 벡터는 fp32로 인코딩)
         self.vectorstore = VectorStore(
             collection_name=self.collection_name,
-            persist_dir=self.persist_dir
+            persist_dir=self.persist_dir,
+            optimize_model=False
         )
         self.vectorstore.add_documents(chunks)
 
@@ -68,10 +71,14 @@ class JustiQ:
         return stats
 
     def load(self) -> None:
-        """기존 벡터 스토어 로드"""
+        """기존 벡터 스토어 로드 (검색 전용: 쿼리 인코딩 최적화 적용)"""
+        from vectorstore import VectorStore
+        from rag_chain import RAGChain
+
         self.vectorstore = VectorStore(
             collection_name=self.collection_name,
-            persist_dir=self.persist_dir
+            persist_dir=self.persist_dir,
+            optimize_model=True
         )
         self.rag_chain = RAGChain(
             vectorstore=self.vectorstore,
@@ -79,7 +86,7 @@ class JustiQ:
         )
         print(f"벡터 스토어 로드 완료 (문서 수: {self.vectorstore.collection.count()})")
 
-    def query(self, question: str, n_results: int = 5) -> dict:
+    def query(self, question: str, n_results: int = 3) -> dict:
         """
         질문에 대한 답변 생성
 
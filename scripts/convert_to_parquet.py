@@ -0,0 +1,60 @@
+"""
+CSV → Parquet 변환 스크립트
+- data_sampled/<유형>/*.csv 를 같은 위치의 *.parquet (snappy 압축) 로 변환
+- LegalDataLoader는 같은 이름의 Parquet 파일이 CSV보다 오래되지 않았으면 CSV 대신 사용
+- 이미 변환된 파일도 CSV가 더 최근에 수정되었으면 다시 변환
+"""
+
+import argparse
+from pathlib import Path
+
+import pandas as pd
+from tqdm import tqdm
+
+
+def read_csv(file_path: Path) -> pd.DataFrame:
+    """CSV 읽기 (UTF-8 실패 시 CP949)"""
+    try:
+        return pd.read_csv(file_path, encoding='utf-8', dtype=str, engine='c')
+    except UnicodeDecodeError:
+        return pd.read_csv(file_path, encoding='cp949', dtype=str, engine='c')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV 데이터를 Parquet으로 변환")
+    parser.add_argument("--data-dir", type=str, default="data_sampled", help="데이터 디렉토리")
+    parser.add_argument("--overwrite", action="store_true", help="최신 Parquet 파일도 모두 다시 변환")
+    args = parser.parse_args()
+
+    csv_files = sorted(Path(args.data_dir).rglob("*.csv"))
+    print(f"CSV 파일: {len(csv_files)}개")
+
+    converted = 0
+    csv_bytes = 0
+    parquet_bytes = 0
+
+    for csv_path in tqdm(csv_files, desc="변환"):
+        parquet_path = csv_path.with_suffix(".parquet")
+        is_up_to_date = parquet_path.exists() and parquet_path.stat().st_mtime >= csv_path.stat().st_mtime
+        if is_up_to_date and not args.overwrite:
+            continue
+
+        try:
+            df = read_csv(csv_path)
+            df.to_parquet(parquet_path, compression="snappy", index=False)
+        except Exception as e:
+            print(f"[에러] {csv_path}: {e}")
+            continue
+
+        converted += 1
+        csv_bytes += csv_path.stat().st_size
+        parquet_bytes += parquet_path.stat().st_size
+
+    print(f"\n{'='*40}")
+    print(f"변환 완료: {converted}개")
+    if converted:
+        print(f"용량: CSV {csv_bytes / 1e6:.1f}MB → Parquet {parquet_bytes / 1e6:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
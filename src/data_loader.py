@@ -1,21 +1,69 @@
 """
 형사법 RAG 데이터 로더
-- CSV 파일에서 판례, 결정문, 법령, 해석 데이터 로드
-- 청킹 및 메타데이터 추출
+- CSV(또는 변환된 Parquet) 파일에서 판례, 결정문, 법령, 해석 데이터 로드
+- 청킹 및 메타데이터 추출 (청크는 필드별 병렬 리스트인 Chunks로 반환)
 """
 
 import os
-import pandas as pd
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from tqdm import tqdm
 
 
+# 문장 끝: 공백/문서 끝 앞의 문장부호, 또는 줄바꿈 (CSV 행 경계)
+SENTENCE_END = re.compile(r'[.!?](?=\s|$)|\n')
+
+
+@dataclass
+class Chunks:
+    """
+    청크 모음 (컬럼형 레이아웃)
+
+    청크마다 dict를 만드는 대신 필드별 리스트를 두고, i번째 원소끼리 한 청크를 이룬다.
+    임베딩에는 contents를 그대로 넘기고, 메타데이터는 저장 시점에 metadata(i)로 만든다.
+    """
+    contents: List[str] = field(default_factory=list)
+    chunk_ids: List[str] = field(default_factory=list)
+    chunk_idxs: List[int] = field(default_factory=list)
+    doc_ids: List[str] = field(default_factory=list)
+    types: List[str] = field(default_factory=list)
+    type_names: List[str] = field(default_factory=list)
+    file_paths: List[str] = field(default_factory=list)
+    sections: List[Optional[str]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def extend(self, other: "Chunks") -> None:
+        """다른 Chunks의 청크를 뒤에 이어 붙임"""
+        for f in fields(self):
+            getattr(self, f.name).extend(getattr(other, f.name))
+
+    def metadata(self, i: int) -> Dict[str, Any]:
+        """i번째 청크의 메타데이터 (ChromaDB 저장 형식)"""
+        metadata = {
+            "doc_id": self.doc_ids[i],
+            "file_path": self.file_paths[i],
+            "type": self.types[i],
+            "type_name": self.type_names[i],
+            "chunk_idx": self.chunk_idxs[i],
+            "chunk_id": self.chunk_ids[i]
+        }
+        if self.sections[i] is not None:
+            metadata["sections"] = self.sections[i]
+        return metadata
+
+
 class LegalDataLoader:
     """법률 데이터 로더"""
 
-    def __init__(self, data_dir: str = "data_sampled"):
+    def __init__(self, data_dir: str = "data_sampled", num_workers: Optional[int] = None):
         self.data_dir = Path(data_dir)
+        self.num_workers = num_workers or os.cpu_count()
         self.data_types = {
             "judgement": "판례",
             "decision": "결정문",
@@ -23,25 +71,34 @@ class LegalDataLoader:
             "interpretation": "해석"
         }
 
-    def load_csv(self, file_path: Path) -> Dict[str, Any]:
-        """단일 CSV 파일 로드 및 파싱"""
-        try:
-            df = pd.read_csv(file_path, encoding='utf-8')
-        except UnicodeDecodeError:
-            df = pd.read_csv(file_path, encoding='cp949')
+    @staticmethod
+    def load_csv(file_path: str) -> Dict[str, Any]:
+        """단일 CSV/Parquet 파일 로드 및 파싱 (프로세스 풀에서 호출되도록 정적 메서드)"""
+        # pandas는 인덱싱 워커에서만 필요 (검색 경로에서 Chunks만 쓰는 경우 임포트 생략)
+        import pandas as pd
+
+        if file_path.endswith(".parquet"):
+            # scripts/convert_to_parquet.py 로 변환된 파일 (컬럼 타입 보존, 파싱 불필요)
+            df = pd.read_parquet(file_path)
+        else:
+            # 모든 컬럼을 문자열로 읽어 타입 추론 생략
+            try:
+                df = pd.read_csv(file_path, encoding='utf-8', dtype=str, engine='c')
+            except UnicodeDecodeError:
+                df = pd.read_csv(file_path, encoding='cp949', dtype=str, engine='c')
 
         # 컬럼명 정리
         df.columns = df.columns.str.strip()
 
         # 문서 ID 추출
-        doc_id = file_path.stem  # 파일명에서 확장자 제거
+        doc_id = Path(file_path).stem  # 파일명에서 확장자 제거
 
         # 내용 합치기
         if '내용' in df.columns:
-            content = '\n'.join(df['내용'].dropna().astype(str).tolist())
+            content = df['내용'].dropna().str.cat(sep='\n')
         else:
             # 모든 컬럼의 데이터를 합침
-            content = '\n'.join(df.iloc[:, -1].dropna().astype(str).tolist())
+            content = df.iloc[:, -1].dropna().str.cat(sep='\n')
 
         # 메타데이터 추출
         metadata = {
@@ -60,70 +117,119 @@ class LegalDataLoader:
         }
 
     def load_all(self) -> List[Dict[str, Any]]:
-        """모든 데이터 로드"""
+        """모든 데이터 로드 (CSV 파싱은 프로세스 풀에서 병렬 처리)"""
         documents = []
 
-        for data_type, type_name in self.data_types.items():
-            type_dir = self.data_dir / data_type
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            for data_type, type_name in self.data_types.items():
+                type_dir = os.path.join(self.data_dir, data_type)
+
+                if not os.path.isdir(type_dir):
+                    print(f"[경고] {type_dir} 폴더가 없습니다.")
+                    continue
+
+                # os.scandir: 디렉토리 항목의 파일 타입 정보를 재사용해 stat 호출 최소화
+                csv_entries = {}
+                parquet_entries = {}
+                with os.scandir(type_dir) as entries:
+                    for entry in entries:
+                        stem, ext = os.path.splitext(entry.name)
+                        if ext == ".csv" and entry.is_file():
+                            csv_entries[stem] = entry
+                        elif ext == ".parquet" and entry.is_file():
+                            parquet_entries[stem] = entry
+
+                # 같은 이름의 Parquet 파일은 CSV보다 오래되지 않았을 때만 사용
+                # (변환 후 CSV가 수정되었다면 오래된 Parquet 대신 CSV를 읽음)
+                data_files = []
+                for stem, csv_entry in csv_entries.items():
+                    parquet_entry = parquet_entries.pop(stem, None)
+                    if parquet_entry is not None and parquet_entry.stat().st_mtime >= csv_entry.stat().st_mtime:
+                        data_files.append(parquet_entry.path)
+                    else:
+                        data_files.append(csv_entry.path)
+                data_files.extend(entry.path for entry in parquet_entries.values())
+                print(f"\n[{type_name}] {len(data_files)}개 파일 로드 중...")
+
+                results = executor.map(_load_csv_safe, data_files, chunksize=16)
+                for file_path, (doc, error) in tqdm(zip(data_files, results), total=len(data_files), desc=type_name):
+                    if error is not None:
+                        print(f"[에러] {file_path}: {error}")
+                        continue
 
-            if not type_dir.exists():
-                print(f"[경고] {type_dir} 폴더가 없습니다.")
-                continue
-
-            csv_files = list(type_dir.glob("*.csv"))
-            print(f"\n[{type_name}] {len(csv_files)}개 파일 로드 중...")
-
-            for file_path in tqdm(csv_files, desc=type_name):
-                try:
-                    doc = self.load_csv(file_path)
                     doc["metadata"]["type"] = data_type
                     doc["metadata"]["type_name"] = type_name
                     documents.append(doc)
-                except Exception as e:
-                    print(f"[에러] {file_path}: {e}")
 
         print(f"\n총 {len(documents)}개 문서 로드 완료")
         return documents
 
-    def chunk_document(self, doc: Dict[str, Any], chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
-        """문서를 청크로 분할"""
+    def chunk_document(self, doc: Dict[str, Any], chunk_size: int = 1000, overlap: int = 200) -> Chunks:
+        """
+        문서를 문장 단위 청크로 분할
+
+        chunk_size 글자 안에 들어가는 완결된 문장들을 묶고,
+        직전 청크의 마지막 overlap 글자 이내 문장들을 다음 청크 앞에 다시 포함한다.
+        한 문장이 chunk_size보다 길면 글자 수 기준으로 자른다.
+        """
         content = doc["content"]
         metadata = doc["metadata"]
+        doc_id = metadata["doc_id"]
 
-        chunks = []
+        contents = []
         start = 0
-        chunk_idx = 0
-
-        while start < len(content):
-            end = start + chunk_size
-            chunk_text = content[start:end]
-
-            # 문장 단위로 자르기 (마지막 마침표 찾기)
-            if end < len(content):
-                last_period = chunk_text.rfind('.')
-                if last_period > chunk_size // 2:
-                    chunk_text = chunk_text[:last_period + 1]
-                    end = start + last_period + 1
 
-            chunk_metadata = metadata.copy()
-            chunk_metadata["chunk_idx"] = chunk_idx
-            chunk_metadata["chunk_id"] = f"{metadata['doc_id']}_chunk_{chunk_idx}"
+        # 문장 경계 위치를 한 번만 계산해 두고 청크마다 이진 탐색
+        boundaries = [m.end() for m in SENTENCE_END.finditer(content)]
 
-            chunks.append({
-                "content": chunk_text.strip(),
-                "metadata": chunk_metadata
-            })
-
-            start = end - overlap
-            chunk_idx += 1
-
-        return chunks
-
-    def load_and_chunk(self, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
+        while start < len(content):
+            limit = start + chunk_size
+            hard_cut = False
+
+            if limit >= len(content):
+                end = len(content)
+            else:
+                # chunk_size 안에 들어가는 마지막 문장 경계까지 묶기
+                idx = bisect_right(boundaries, limit) - 1
+                if idx >= 0 and boundaries[idx] > start:
+                    end = boundaries[idx]
+                else:
+                    end = limit
+                    hard_cut = True
+
+            chunk_text = content[start:end].strip()
+
+            if chunk_text:
+                contents.append(chunk_text)
+
+            if end >= len(content):
+                break
+
+            # 다음 청크 시작: 마지막 overlap 글자 안에서 시작하는 첫 문장
+            if hard_cut:
+                start = max(end - overlap, start + 1)
+            else:
+                idx = bisect_left(boundaries, end - overlap)
+                start = boundaries[idx] if boundaries[idx] > start and boundaries[idx] < end else end
+
+        # 문서 단위 메타데이터는 청크 수만큼 같은 값을 참조
+        n = len(contents)
+        return Chunks(
+            contents=contents,
+            chunk_ids=[f"{doc_id}_chunk_{i}" for i in range(n)],
+            chunk_idxs=list(range(n)),
+            doc_ids=[doc_id] * n,
+            types=[metadata.get("type", "")] * n,
+            type_names=[metadata.get("type_name", "")] * n,
+            file_paths=[metadata.get("file_path", "")] * n,
+            sections=[metadata.get("sections")] * n
+        )
+
+    def load_and_chunk(self, chunk_size: int = 1000, overlap: int = 200) -> Chunks:
         """데이터 로드 및 청킹"""
         documents = self.load_all()
 
-        all_chunks = []
+        all_chunks = Chunks()
         print(f"\n문서 청킹 중 (chunk_size={chunk_size}, overlap={overlap})...")
 
         for doc in tqdm(documents, desc="청킹"):
@@ -134,6 +240,14 @@ class LegalDataLoader:
         return all_chunks
 
 
+def _load_csv_safe(file_path: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """프로세스 풀 작업 함수: 실패한 파일은 에러 메시지로 반환"""
+    try:
+        return LegalDataLoader.load_csv(file_path), None
+    except Exception as e:
+        return None, str(e)
+
+
 if __name__ == "__main__":
     # 테스트
     loader = LegalDataLoader("data_sampled")
@@ -142,7 +256,6 @@ if __name__ == "__main__":
     # 샘플 출력
     if chunks:
         print("\n=== 샘플 청크 ===")
-        sample = chunks[0]
-        print(f"ID: {sample['metadata']['chunk_id']}")
-        print(f"타입: {sample['metadata']['type_name']}")
-        print(f"내용 (앞 200자): {sample['content'][:200]}...")
+        print(f"ID: {chunks.chunk_ids[0]}")
+        print(f"타입: {chunks.type_names[0]}")
+        print(f"내용 (앞 200자): {chunks.contents[0][:200]}...")
@@ -6,13 +6,19 @@ RAG 체인
 """
 
 import os
-from typing import List, Dict, Any, Optional
+import re
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Iterator
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from langsmith import traceable
 
-from vectorstore import VectorStore
+# 무거운 모듈(openai 클라이언트, chromadb/torch)은 실제 사용 시점에 임포트
+if TYPE_CHECKING:
+    from vectorstore import VectorStore
 
 load_dotenv()
 
@@ -28,6 +34,35 @@ def setup_langsmith():
 
 LANGSMITH_ENABLED = setup_langsmith()
 
+NO_RESULTS_ANSWER = "관련 문서를 찾을 수 없습니다."
+
+# 컨텍스트 토큰 예산 계산 시 사용자 메시지 템플릿/문서 헤더 몫으로 남겨두는 토큰 수
+PROMPT_RESERVE_TOKENS = 600
+
+# 질문 변형 출력의 줄머리 번호 ("1. ", "2) ")
+NUMBERING = re.compile(r"^\s*\d+[.)]\s*")
+
+
+def reciprocal_rank_fusion(
+    result_lists: List[List[Dict[str, Any]]],
+    n_results: int,
+    k: int = 60
+) -> List[Dict[str, Any]]:
+    """여러 검색 결과 리스트를 RRF(1 / (k + 순위))로 합쳐 상위 n_results개 반환"""
+    scores: Dict[str, float] = {}
+    best: Dict[str, Dict[str, Any]] = {}
+
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            doc_id = result["id"]
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+            # 같은 문서는 가장 가까운 거리의 결과를 대표로 사용
+            if doc_id not in best or result["distance"] < best[doc_id]["distance"]:
+                best[doc_id] = result
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [best[doc_id] for doc_id in ranked[:n_results]]
+
 
 def get_llm_config() -> dict:
     """LLM 설정 가져오기 (OpenRouter, OpenAI, Solar 지원)"""
@@ -66,11 +101,34 @@ class RAGChain:
 
     def __init__(
         self,
-        vectorstore: VectorStore,
-        temperature: float = 0.7
+        vectorstore: "VectorStore",
+        temperature: float = 0.7,
+        cache_size: Optional[int] = None,
+        num_query_variants: int = 0,
+        context_window: int = 8192
     ):
+        """
+        Args:
+            vectorstore: 검색에 사용할 벡터 스토어
+            temperature: LLM 샘플링 온도
+            cache_size: 답변 캐시 최대 항목 수 (0이면 캐시 사용 안 함).
+                        None이면 temperature == 0일 때만 128로 켜고,
+                        temperature > 0이면 매번 새로 샘플링하도록 끈다.
+            num_query_variants: 멀티 쿼리 검색용으로 LLM이 생성할 질문 변형 수
+                                (0이면 원본 질문만 검색)
+            context_window: 프롬프트(시스템 + 문서 + 질문) 최대 토큰 수
+        """
         self.vectorstore = vectorstore
         self.temperature = temperature
+        self.num_query_variants = num_query_variants
+
+        # (질문, 검색 수, 필터, 모델) → 답변 LRU 캐시
+        if cache_size is None:
+            cache_size = 128 if temperature == 0 else 0
+        self.cache_size = cache_size
+        self._answer_cache = OrderedDict()
+        # st.cache_resource로 여러 세션 스레드가 같은 인스턴스를 공유하므로 잠금 필요
+        self._cache_lock = threading.Lock()
 
         # LLM 설정 가져오기 (OpenRouter, OpenAI, Solar 자동 감지)
         llm_config = get_llm_config()
@@ -78,6 +136,7 @@ class RAGChain:
         self.provider = llm_config["provider"]
 
         # LangChain ChatOpenAI - 자동 트레이싱 지원
+        from langchain_openai import ChatOpenAI
         self.llm = ChatOpenAI(
             model=self.model,
             temperature=temperature,
@@ -97,39 +156,208 @@ class RAGChain:
 5. 답변은 명확하고 이해하기 쉽게 작성해주세요.
 """
 
+        # 고정 프롬프트는 매 요청 동일한 prefix로 재사용 (프롬프트 캐싱 대상)
+        self.system_message = self._build_system_message()
+
+        # 컨텍스트 토큰 예산 (모델별 토크나이저 대신 cl100k_base로 근사)
+        import tiktoken
+        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.context_window = context_window
+        self.system_tokens = len(self.tokenizer.encode(self.system_prompt))
+
+    def _cache_key(self, question: str, n_results: int, filter_type: Optional[str]) -> str:
+        """정규화한 질문과 검색 조건으로 캐시 키 생성"""
+        normalized = " ".join(question.split()).lower()
+        raw = f"{normalized}|{n_results}|{filter_type}|{self.model}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """캐시 조회 (적중 시 최근 사용으로 갱신)"""
+        with self._cache_lock:
+            cached = self._answer_cache.get(key)
+            if cached is not None:
+                self._answer_cache.move_to_end(key)
+            return cached
+
+    def _cache_put(self, key: str, answer: str, sources: List[Dict[str, Any]]) -> None:
+        """답변 캐시 저장 (가장 오래 사용하지 않은 항목부터 제거)"""
+        if self.cache_size <= 0:
+            return
+
+        with self._cache_lock:
+            self._answer_cache[key] = {"answer": answer, "sources": sources}
+            self._answer_cache.move_to_end(key)
+            while len(self._answer_cache) > self.cache_size:
+                self._answer_cache.popitem(last=False)
+
+    def _expansion_messages(self, question: str) -> list:
+        """질문 변형 생성용 메시지 구성"""
+        return [
+            SystemMessage(content="당신은 법률 문서 검색을 돕는 어시스턴트입니다."),
+            HumanMessage(content=(
+                f"다음 질문과 같은 뜻이지만 다른 표현(법률 용어 포함)의 검색 질의를 "
+                f"{self.num_query_variants}개 작성하세요. 한 줄에 하나씩, 번호나 설명 없이 질의만 출력하세요.\n\n"
+                f"질문: {question}"
+            ))
+        ]
+
+    def _parse_variants(self, question: str, text: str) -> List[str]:
+        """LLM 출력에서 질문 변형 추출 (원본 질문을 맨 앞에 유지)"""
+        # "1. ", "2) " 같은 번호 접두어를 지워야 중복/원본 질문 비교가 맞음
+        variants = [NUMBERING.sub("", line).strip(" -•\t") for line in text.splitlines()]
+        variants = [v for v in dict.fromkeys(variants) if v and v != question]
+        return [question, *variants[:self.num_query_variants]]
+
+    def _expand_query(self, question: str) -> List[str]:
+        """검색 질의 목록 생성 (원본 + LLM 변형)"""
+        if self.num_query_variants <= 0:
+            return [question]
+
+        response = self.llm.invoke(self._expansion_messages(question))
+        return self._parse_variants(question, response.content)
+
+    async def _aexpand_query(self, question: str) -> List[str]:
+        """검색 질의 목록 생성 (비동기)"""
+        if self.num_query_variants <= 0:
+            return [question]
+
+        response = await self.llm.ainvoke(self._expansion_messages(question))
+        return self._parse_variants(question, response.content)
+
+    def _retrieve(
+        self,
+        queries: List[str],
+        n_results: int,
+        filter_type: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        """관련 문서 검색 (질의가 여러 개면 한 번에 배치 검색 후 RRF로 병합)"""
+        if len(queries) == 1:
+            return self.vectorstore.search(
+                query=queries[0],
+                n_results=n_results,
+                filter_type=filter_type
+            )
+
+        result_lists = self.vectorstore.search_many(
+            queries,
+            n_results=n_results,
+            filter_type=filter_type
+        )
+        return reciprocal_rank_fusion(result_lists, n_results)
+
+    def _pack_context(self, search_results: List[Dict[str, Any]], question: str) -> List[Dict[str, Any]]:
+        """
+        토큰 예산 안에 들어가는 검색 결과만 순위 순으로 선택
+
+        예산 = context_window - 시스템 프롬프트 - 질문 - PROMPT_RESERVE_TOKENS.
+        예산을 넘는 하위 순위 문서는 제외하고, 1위 문서조차 넘치면 잘라서 사용한다.
+        예산이 남지 않으면(질문이 매우 긴 경우) 빈 리스트를 반환한다.
+        """
+        budget = (
+            self.context_window
+            - self.system_tokens
+            - len(self.tokenizer.encode(question))
+            - PROMPT_RESERVE_TOKENS
+        )
+
+        packed = []
+        for result in search_results:
+            tokens = self.tokenizer.encode(result["content"])
+            if len(tokens) <= budget:
+                packed.append(result)
+                budget -= len(tokens)
+            elif not packed and budget > 0:
+                # 토큰 경계가 한글 UTF-8 바이트 중간일 수 있어 불완전한 끝 문자는 버림
+                truncated = self.tokenizer.decode_bytes(tokens[:budget]).decode("utf-8", errors="ignore")
+                packed.append({**result, "content": truncated})
+                break
+            else:
+                break
+
+        return packed
+
     def _format_context(self, search_results: List[Dict[str, Any]]) -> str:
         """검색 결과를 컨텍스트로 포맷팅"""
-        context_parts = []
+        return "\n---\n".join(
+            f"[문서 {i}] ({r['metadata'].get('type_name', '문서')}) - {r['metadata'].get('doc_id', 'unknown')}\n{r['content']}\n"
+            for i, r in enumerate(search_results, 1)
+        )
 
-        for i, result in enumerate(search_results, 1):
-            metadata = result["metadata"]
-            type_name = metadata.get("type_name", "문서")
-            doc_id = metadata.get("doc_id", "unknown")
+    def _supports_cache_control(self) -> bool:
+        """명시적 cache_control 지정이 필요한 모델인지 (OpenRouter 경유 Anthropic/Gemini)"""
+        return self.provider == "openrouter" and self.model.startswith(("anthropic/", "google/"))
 
-            context_parts.append(
-                f"[문서 {i}] ({type_name}) - {doc_id}\n{result['content']}\n"
-            )
+    def _build_system_message(self) -> SystemMessage:
+        """
+        시스템 메시지 구성
+
+        OpenAI 등은 동일한 prefix를 자동으로 캐싱하고, Anthropic/Gemini 경로는
+        cache_control 블록으로 지정해야 캐싱된다. 질문과 컨텍스트는 항상
+        이후 메시지에 두어 캐시 구간이 바뀌지 않도록 한다.
+        """
+        if not self._supports_cache_control():
+            return SystemMessage(content=self.system_prompt)
+
+        return SystemMessage(content=[
+            {
+                "type": "text",
+                "text": self.system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ])
 
-        return "\n---\n".join(context_parts)
+    def _build_messages(self, question: str, context: str) -> list:
+        """시스템 프롬프트(고정) + 컨텍스트/질문(가변) 메시지 구성"""
+        user_message = f"""다음은 관련 법률 문서입니다:
+
+{context}
+
+---
+
+질문: {question}
+
+위 문서를 참고하여 답변해주세요."""
+
+        return [
+            self.system_message,
+            HumanMessage(content=user_message)
+        ]
+
+    def _format_sources(self, search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """검색 결과를 참고 문서 목록으로 변환"""
+        return [
+            {
+                "doc_id": r["metadata"]["doc_id"],
+                "type": r["metadata"]["type_name"],
+                "distance": r["distance"]
+            }
+            for r in search_results
+        ]
 
     @traceable(name="rag_query")
     def query(
         self,
         question: str,
-        n_results: int = 5,
+        n_results: int = 3,
         filter_type: Optional[str] = None
     ) -> Dict[str, Any]:
         """질문에 대한 답변 생성"""
+        # 0. 캐시 확인
+        cache_key = self._cache_key(question, n_results, filter_type)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return {**cached, "question": question}
+
         # 1. 관련 문서 검색
-        search_results = self.vectorstore.search(
-            query=question,
-            n_results=n_results,
-            filter_type=filter_type
-        )
+        queries = self._expand_query(question)
+        search_results = self._retrieve(queries, n_results, filter_type)
+
+        # 토큰 예산 내로 제한 (질문이 너무 길어 예산이 없으면 빈 결과)
+        search_results = self._pack_context(search_results, question)
 
         if not search_results:
             return {
-                "answer": "관련 문서를 찾을 수 없습니다.",
+                "answer": NO_RESULTS_ANSWER,
                 "sources": [],
                 "question": question
             }
@@ -138,33 +366,59 @@ class RAGChain:
         context = self._format_context(search_results)
 
         # 3. LLM 호출 (LangChain - 자동 트레이싱)
-        user_message = f"""다음은 관련 법률 문서입니다:
+        messages = self._build_messages(question, context)
+        response = self.llm.invoke(messages)
+        answer = response.content
 
-{context}
+        # 4. 결과 반환
+        sources = self._format_sources(search_results)
+        self._cache_put(cache_key, answer, sources)
 
----
+        return {
+            "answer": answer,
+            "sources": sources,
+            "question": question
+        }
 
-질문: {question}
+    @traceable(name="rag_aquery")
+    async def aquery(
+        self,
+        question: str,
+        n_results: int = 3,
+        filter_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """질문에 대한 답변 생성 (비동기 LLM 호출)"""
+        # 0. 캐시 확인
+        cache_key = self._cache_key(question, n_results, filter_type)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return {**cached, "question": question}
 
-위 문서를 참고하여 답변해주세요."""
+        # 1. 관련 문서 검색 (질문 변형만 비동기, 검색은 로컬 연산이라 동기 호출)
+        queries = await self._aexpand_query(question)
+        search_results = self._retrieve(queries, n_results, filter_type)
 
-        messages = [
-            SystemMessage(content=self.system_prompt),
-            HumanMessage(content=user_message)
-        ]
+        # 토큰 예산 내로 제한 (질문이 너무 길어 예산이 없으면 빈 결과)
+        search_results = self._pack_context(search_results, question)
 
-        response = self.llm.invoke(messages)
+        if not search_results:
+            return {
+                "answer": NO_RESULTS_ANSWER,
+                "sources": [],
+                "question": question
+            }
+
+        # 2. 컨텍스트 구성
+        context = self._format_context(search_results)
+
+        # 3. LLM 호출 - 응답 대기 중 다른 질문 처리 가능
+        messages = self._build_messages(question, context)
+        response = await self.llm.ainvoke(messages)
         answer = response.content
 
         # 4. 결과 반환
-        sources = [
-            {
-                "doc_id": r["metadata"]["doc_id"],
-                "type": r["metadata"]["type_name"],
-                "distance": r["distance"]
-            }
-            for r in search_results
-        ]
+        sources = self._format_sources(search_results)
+        self._cache_put(cache_key, answer, sources)
 
         return {
             "answer": answer,
@@ -172,9 +426,90 @@ class RAGChain:
             "question": question
         }
 
+    async def aquery_many(
+        self,
+        questions: List[str],
+        n_results: int = 3,
+        filter_type: Optional[str] = None,
+        max_concurrency: int = 8
+    ) -> List[Dict[str, Any]]:
+        """여러 질문을 동시에 처리 (동시 LLM 요청 수는 max_concurrency로 제한)"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(question: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.aquery(question, n_results=n_results, filter_type=filter_type)
+
+        return await asyncio.gather(*(run(q) for q in questions))
+
+    @traceable(name="rag_answer_stream")
+    def _stream_answer(self, messages: list) -> Iterator[str]:
+        """LLM 응답을 토큰 단위로 스트리밍"""
+        for chunk in self.llm.stream(messages):
+            if chunk.content:
+                yield chunk.content
+
+    def _cache_stream(self, cache_key: str, stream: Iterator[str], sources: List[Dict[str, Any]]) -> Iterator[str]:
+        """스트림을 그대로 전달하면서, 끝까지 받은 답변은 캐시에 저장"""
+        parts = []
+        for token in stream:
+            parts.append(token)
+            yield token
+
+        self._cache_put(cache_key, "".join(parts), sources)
+
+    def query_stream(
+        self,
+        question: str,
+        n_results: int = 3,
+        filter_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        질문에 대한 답변을 스트리밍으로 생성
+
+        검색은 즉시 수행하고, 답변은 "answer_stream" 제너레이터로 반환한다.
+        (Streamlit에서는 st.write_stream에 그대로 전달)
+        """
+        # 0. 캐시 확인 (적중 시 저장된 답변을 한 번에 전달)
+        cache_key = self._cache_key(question, n_results, filter_type)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return {
+                "answer_stream": iter([cached["answer"]]),
+                "sources": cached["sources"],
+                "question": question
+            }
+
+        # 1. 관련 문서 검색
+        queries = self._expand_query(question)
+        search_results = self._retrieve(queries, n_results, filter_type)
+
+        # 토큰 예산 내로 제한 (질문이 너무 길어 예산이 없으면 빈 결과)
+        search_results = self._pack_context(search_results, question)
+
+        if not search_results:
+            return {
+                "answer_stream": iter([NO_RESULTS_ANSWER]),
+                "sources": [],
+                "question": question
+            }
+
+        # 2. 컨텍스트 구성 후 스트리밍 시작
+        context = self._format_context(search_results)
+        messages = self._build_messages(question, context)
+        sources = self._format_sources(search_results)
+
+        return {
+            "answer_stream": self._cache_stream(cache_key, self._stream_answer(messages), sources),
+            "sources": sources,
+            "question": question
+        }
+
 
 def main():
     """RAG 체인 테스트"""
+    from vectorstore import VectorStore
+
     # 벡터 스토어 로드 (이미 인덱싱된 경우)
     vectorstore = VectorStore()
 
@@ -188,13 +523,14 @@ def main():
         "사기죄 성립 요건은 무엇인가요?"
     ]
 
-    for question in test_questions:
+    # 질문들의 LLM 호출을 동시에 실행
+    results = asyncio.run(rag.aquery_many(test_questions))
+
+    for question, result in zip(test_questions, results):
         print(f"\n{'='*60}")
         print(f"질문: {question}")
         print("="*60)
 
-        result = rag.query(question)
-
         print(f"\n답변:\n{result['answer']}")
         print(f"\n참고 문서:")
         for src in result["sources"]:
@@ -2,18 +2,24 @@
 벡터 스토어 관리
 - multilingual-e5-large 임베딩
 - ChromaDB 벡터 저장소
+- FAISS 근사 최근접 이웃(ANN) 인덱스
 """
 
 import os
+import heapq
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Union
 from tqdm import tqdm
 
+import numpy as np
 import torch
+import faiss
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 
+from data_loader import Chunks
+
 
 def get_device() -> str:
     """사용 가능한 디바이스 자동 감지 (CUDA > MPS > CPU)"""
@@ -32,19 +38,39 @@ class VectorStore:
         self,
         collection_name: str = "legal_documents",
         persist_dir: str = "chroma_db",
-        embedding_model: str = "intfloat/multilingual-e5-large"
+        embedding_model: str = "intfloat/multilingual-e5-large",
+        index_factory: str = "HNSW32,SQ8",
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        nprobe: int = 8,
+        tail_threshold: int = 1000,
+        optimize_model: bool = False
     ):
         self.collection_name = collection_name
         self.persist_dir = Path(persist_dir)
         self.persist_dir.mkdir(exist_ok=True)
 
-        # 디바이스 설정
+        # FAISS 인덱스 설정 (기본: HNSW 그래프 + int8 스칼라 양자화 벡터)
+        self.index_factory = index_factory
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.tail_threshold = tail_threshold
+        self.index_path = self.persist_dir / f"{collection_name}.faiss"
+        self.index_ids_path = self.persist_dir / f"{collection_name}_ids.npy"
+
+        # 디바이스 설정 (인코딩 배치 크기: GPU 64, CPU/MPS 32)
         self.device = get_device()
+        self.encode_batch_size = 64 if self.device == "cuda" else 32
+        if self.device == "cpu":
+            torch.set_num_threads(os.cpu_count())
         print(f"사용 디바이스: {self.device}")
 
         # 임베딩 모델 로드
         print(f"임베딩 모델 로드 중: {embedding_model}")
         self.embedding_model = SentenceTransformer(embedding_model, device=self.device)
+        if optimize_model:
+            self._optimize_model()
         print("임베딩 모델 로드 완료")
 
         # ChromaDB 클라이언트 초기화
@@ -61,52 +87,250 @@ class VectorStore:
 
         print(f"컬렉션 '{collection_name}' 준비 완료 (문서 수: {self.collection.count()})")
 
-    def _get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """텍스트 임베딩 생성 (E5 모델용 prefix 추가)"""
-        # E5 모델은 "passage: " prefix 필요
-        prefixed_texts = [f"passage: {text}" for text in texts]
+        # FAISS 인덱스 로드 + 인덱스 이후 추가된 문서는 tail(전수 검색)로 관리
+        self.index = None
+        self.index_ids: Sequence[str] = []
+        self.tail_vecs: Optional[np.ndarray] = None
+        self.tail_ids: List[str] = []
+        self._load_index()
+        self._sync_index()
+
+    def _optimize_model(self) -> None:
+        """
+        CUDA에서 임베딩 모델을 bf16으로 변환하고 torch.compile 적용
+
+        쿼리 인코딩 속도를 위한 옵션이므로 검색 전용으로 로드할 때만 사용한다.
+        (인덱싱에 쓰면 문서 벡터가 bf16 정밀도로 저장됨)
+        """
+        if self.device != "cuda":
+            return
+
+        if torch.cuda.is_bf16_supported():
+            self.embedding_model.to(torch.bfloat16)
+            print("임베딩 모델 bf16 변환 완료")
+
+        # SentenceTransformer의 트랜스포머 본체만 컴파일 (pooling/normalize는 그대로)
+        # CUDA graph는 스레드별로 기록되어 Streamlit 스크립트 스레드마다 재기록되므로
+        # 사용하지 않는 기본 모드로 컴파일
+        transformer = self.embedding_model[0]
+        transformer.auto_model = torch.compile(transformer.auto_model, mode="default")
+
+    def warmup(self) -> None:
+        """더미 쿼리로 첫 인코딩(컴파일, CUDA 초기화) 비용을 미리 지불"""
+        self._get_query_embeddings(["워밍업"])
+
+    def _encode(self, texts, batch_size: int, show_progress_bar: bool = False) -> np.ndarray:
+        """정규화된 float32 임베딩 생성 (bf16 모델 출력도 float32로 변환)"""
         embeddings = self.embedding_model.encode(
-            prefixed_texts,
-            show_progress_bar=False,
-            convert_to_numpy=True
+            texts,
+            batch_size=batch_size,
+            show_progress_bar=show_progress_bar,
+            convert_to_tensor=True,
+            normalize_embeddings=True
         )
-        return embeddings.tolist()
+        return embeddings.float().cpu().numpy()
+
+    def _get_embeddings(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        """텍스트 임베딩 생성 (E5 모델용 prefix 추가, L2 정규화)"""
+        # E5 모델은 "passage: " prefix 필요
+        prefixed_texts = [f"passage: {text}" for text in texts]
+        return self._encode(prefixed_texts, self.encode_batch_size, show_progress_bar)
 
-    def _get_query_embedding(self, query: str) -> List[float]:
-        """쿼리 임베딩 생성 (E5 모델용 prefix 추가)"""
+    def _get_query_embeddings(self, queries: List[str]) -> np.ndarray:
+        """쿼리 임베딩 생성 (E5 모델용 prefix 추가, L2 정규화, 여러 쿼리를 한 번의 배치로)"""
         # E5 모델은 쿼리에 "query: " prefix 필요
-        prefixed_query = f"query: {query}"
-        embedding = self.embedding_model.encode(
-            prefixed_query,
-            show_progress_bar=False,
-            convert_to_numpy=True
-        )
-        return embedding.tolist()
+        prefixed_queries = [f"query: {query}" for query in queries]
+        return self._encode(prefixed_queries, batch_size=len(prefixed_queries))
 
-    def add_documents(self, chunks: List[Dict[str, Any]], batch_size: int = 100):
+    def add_documents(self, chunks: Chunks, batch_size: int = 1000):
         """문서 청크를 벡터 스토어에 추가"""
         print(f"\n{len(chunks)}개 청크를 벡터 스토어에 추가 중...")
 
-        for i in tqdm(range(0, len(chunks), batch_size), desc="임베딩"):
-            batch = chunks[i:i + batch_size]
+        ids = chunks.chunk_ids
+        documents = chunks.contents
 
-            ids = [chunk["metadata"]["chunk_id"] for chunk in batch]
-            documents = [chunk["content"] for chunk in batch]
-            metadatas = [chunk["metadata"] for chunk in batch]
+        # 임베딩 생성 (전체 텍스트를 한 번에 넘겨 모델이 배치 단위로 인코딩)
+        embeddings = self._get_embeddings(documents, show_progress_bar=True)
 
-            # 임베딩 생성
-            embeddings = self._get_embeddings(documents)
-
-            # ChromaDB에 추가
+        # ChromaDB에 batch_size 단위로 추가
+        # (임베딩 리스트 변환과 메타데이터 dict 생성은 배치 단위로만 수행)
+        for i in tqdm(range(0, len(chunks), batch_size), desc="저장"):
             self.collection.add(
-                ids=ids,
-                documents=documents,
-                metadatas=metadatas,
-                embeddings=embeddings
+                ids=ids[i:i + batch_size],
+                documents=documents[i:i + batch_size],
+                metadatas=[chunks.metadata(j) for j in range(i, min(i + batch_size, len(chunks)))],
+                embeddings=embeddings[i:i + batch_size].tolist()
             )
 
         print(f"벡터 스토어 저장 완료 (총 문서 수: {self.collection.count()})")
 
+        # 인덱스가 있으면 새 문서는 tail에 추가 (tail_threshold 초과 시 재구축)
+        if self.index is None:
+            self.build_index()
+        else:
+            self._append_tail(ids, embeddings)
+
+    def _append_tail(self, ids: List[str], embeddings: Union[np.ndarray, List[List[float]]]) -> None:
+        """ANN 인덱스에 아직 없는 벡터를 tail에 추가"""
+        # 이미 인덱스나 tail에 있는 ID는 건너뜀 (재인덱싱 시 중복 결과 방지)
+        known = set(self.index_ids)
+        known.update(self.tail_ids)
+        keep = []
+        for pos, doc_id in enumerate(ids):
+            if doc_id not in known:
+                known.add(doc_id)
+                keep.append(pos)
+        if not keep:
+            return
+
+        vecs = np.asarray(embeddings, dtype=np.float32)[keep]
+        ids = [ids[pos] for pos in keep]
+        faiss.normalize_L2(vecs)
+
+        self.tail_vecs = vecs if self.tail_vecs is None else np.vstack([self.tail_vecs, vecs])
+        self.tail_ids.extend(ids)
+
+        if len(self.tail_ids) > self.tail_threshold:
+            print(f"tail 벡터 {len(self.tail_ids)}개 > {self.tail_threshold}, FAISS 인덱스 재구축")
+            self.build_index()
+
+    def _sync_index(self) -> None:
+        """컬렉션과 인덱스 비교: 빠진 문서는 tail로 적재, 삭제된 문서가 있으면 재구축"""
+        if self.collection.count() == 0:
+            return
+
+        if self.index is None:
+            self.build_index()
+            return
+
+        indexed = set(self.index_ids)
+        all_ids = self.collection.get(include=[])["ids"]
+        missing = [doc_id for doc_id in all_ids if doc_id not in indexed]
+
+        if len(all_ids) - len(missing) != len(indexed):
+            self.build_index()
+        elif missing:
+            data = self.collection.get(ids=missing, include=["embeddings"])
+            self._append_tail(data["ids"], data["embeddings"])
+
+    def _set_search_params(self) -> None:
+        """인덱스 종류별 검색 파라미터 설정 (HNSW: efSearch, IVF: nprobe)"""
+        if hasattr(self.index, "hnsw"):
+            self.index.hnsw.efSearch = self.ef_search
+            return
+
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.nprobe = self.nprobe
+
+    def _load_index(self) -> None:
+        """
+        저장된 FAISS 인덱스 로드 (메모리 매핑)
+
+        IO_FLAG_MMAP_IFC로 양자화된 벡터 코드(SQ8/Flat 등 IndexFlatCodes 저장소)를
+        파일에서 직접 mmap해 여러 Streamlit 워커가 OS 페이지 캐시를 공유한다.
+        HNSW 그래프(이웃 리스트, 레벨 정보)는 mmap되지 않고 프로세스 메모리로 복사된다.
+        ID 배열은 np.load(mmap_mode="r")로 매핑한다.
+        """
+        if not (self.index_path.exists() and self.index_ids_path.exists()):
+            return
+
+        self.index = faiss.read_index(str(self.index_path), faiss.IO_FLAG_MMAP_IFC)
+        self.index_ids = np.load(self.index_ids_path, mmap_mode="r")
+        self._set_search_params()
+        print(f"FAISS 인덱스 로드 완료 (벡터 수: {self.index.ntotal})")
+
+    def build_index(self) -> None:
+        """ChromaDB에 저장된 임베딩으로 FAISS 인덱스 학습 및 저장"""
+        data = self.collection.get(include=["embeddings"])
+        if not data["ids"]:
+            return
+
+        # 임베딩은 저장 시 정규화되므로 내적 = 코사인 유사도
+        # (정규화 이전에 저장된 컬렉션을 위해 구축 시 한 번 더 정규화)
+        xb = np.asarray(data["embeddings"], dtype=np.float32)
+        faiss.normalize_L2(xb)
+
+        print(f"FAISS 인덱스 구축 중 ({self.index_factory}, 벡터 수: {len(xb)})...")
+        try:
+            index = faiss.index_factory(xb.shape[1], self.index_factory, faiss.METRIC_INNER_PRODUCT)
+            if hasattr(index, "hnsw"):
+                index.hnsw.efConstruction = self.ef_construction
+            index.train(xb)
+        except RuntimeError as e:
+            # 학습 데이터가 클러스터 수보다 적으면 정확 검색(Flat)으로 대체
+            print(f"[경고] {self.index_factory} 학습 실패, Flat 인덱스 사용: {e}")
+            index = faiss.IndexFlatIP(xb.shape[1])
+        index.add(xb)
+
+        self.index = index
+        self.index_ids = list(data["ids"])
+        self.tail_vecs = None
+        self.tail_ids = []
+        self._set_search_params()
+
+        # ID는 고정 길이 유니코드 배열로 저장해 로드 시 mmap 가능하게 함
+        # 다른 프로세스가 mmap 중인 파일을 덮어쓰지 않도록 임시 파일에 쓴 뒤 교체
+        tmp_index_path = self.index_path.with_suffix(".faiss.tmp")
+        tmp_ids_path = self.index_ids_path.with_suffix(".tmp.npy")
+        faiss.write_index(self.index, str(tmp_index_path))
+        np.save(tmp_ids_path, np.array(self.index_ids))
+        os.replace(tmp_index_path, self.index_path)
+        os.replace(tmp_ids_path, self.index_ids_path)
+        print(f"FAISS 인덱스 저장 완료: {self.index_path}")
+
+    def _search_index(self, query_embeddings: np.ndarray, n_results: int) -> List[List[Dict[str, Any]]]:
+        """FAISS 인덱스 + tail 전수 검색 결과를 병합한 뒤 ChromaDB에서 문서/메타데이터 조회"""
+        # 쿼리 임베딩은 이미 정규화되어 있어 내적만으로 코사인 유사도 계산
+        q = np.asarray(query_embeddings, dtype=np.float32)
+        scores, indices = self.index.search(q, n_results)
+
+        # 인덱스 구축 이후 추가된 문서는 정확한 내적으로 검색해 top-k 병합
+        tail_scores = q @ self.tail_vecs.T if self.tail_ids else None
+
+        hits_per_query = []
+        for row in range(len(q)):
+            hits = [(str(self.index_ids[i]), float(s)) for s, i in zip(scores[row], indices[row]) if i != -1]
+            if tail_scores is not None:
+                hits.extend(zip(self.tail_ids, tail_scores[row].tolist()))
+
+                # 같은 청크가 인덱스와 tail 양쪽에서 나오면 높은 점수 하나만 유지
+                best: Dict[str, float] = {}
+                for doc_id, score in hits:
+                    if doc_id not in best or score > best[doc_id]:
+                        best[doc_id] = score
+                hits = heapq.nlargest(n_results, best.items(), key=lambda hit: hit[1])
+            hits_per_query.append(hits)
+
+        # 모든 쿼리의 결과 문서를 한 번에 조회
+        hit_ids = list(dict.fromkeys(doc_id for hits in hits_per_query for doc_id, _ in hits))
+        if not hit_ids:
+            return [[] for _ in hits_per_query]
+
+        records = self.collection.get(
+            ids=hit_ids,
+            include=["documents", "metadatas"]
+        )
+        by_id = {
+            doc_id: (document, metadata)
+            for doc_id, document, metadata in zip(records["ids"], records["documents"], records["metadatas"])
+        }
+
+        # 코사인 거리(1 - 유사도)로 반환해 ChromaDB 검색 결과와 형식 통일
+        return [
+            [
+                {
+                    "id": doc_id,
+                    "content": by_id[doc_id][0],
+                    "metadata": by_id[doc_id][1],
+                    "distance": 1.0 - score
+                }
+                for doc_id, score in hits
+                if doc_id in by_id
+            ]
+            for hits in hits_per_query
+        ]
+
     def search(
         self,
         query: str,
@@ -114,8 +338,21 @@ class VectorStore:
         filter_type: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """유사 문서 검색"""
+        return self.search_many([query], n_results=n_results, filter_type=filter_type)[0]
+
+    def search_many(
+        self,
+        queries: List[str],
+        n_results: int = 5,
+        filter_type: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """여러 쿼리의 유사 문서 검색 (임베딩과 검색을 각각 한 번에 배치 처리)"""
         # 쿼리 임베딩
-        query_embedding = self._get_query_embedding(query)
+        query_embeddings = self._get_query_embeddings(queries)
+
+        # 필터가 없으면 FAISS 인덱스 사용
+        if self.index is not None and not filter_type:
+            return self._search_index(query_embeddings, n_results)
 
         # 필터 설정
         where_filter = None
@@ -124,30 +361,36 @@ class VectorStore:
 
         # 검색
         results = self.collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=query_embeddings.tolist(),
             n_results=n_results,
             where=where_filter,
             include=["documents", "metadatas", "distances"]
         )
 
-        # 결과 정리
-        search_results = []
-        for i in range(len(results["ids"][0])):
-            search_results.append({
-                "id": results["ids"][0][i],
-                "content": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i],
-                "distance": results["distances"][0][i]
-            })
-
-        return search_results
+        # 결과 정리 (쿼리별 리스트)
+        all_results = []
+        for row in range(len(queries)):
+            search_results = []
+            for i in range(len(results["ids"][row])):
+                search_results.append({
+                    "id": results["ids"][row][i],
+                    "content": results["documents"][row][i],
+                    "metadata": results["metadatas"][row][i],
+                    "distance": results["distances"][row][i]
+                })
+            all_results.append(search_results)
+
+        return all_results
 
     def get_stats(self) -> Dict[str, Any]:
         """벡터 스토어 통계"""
         return {
             "collection_name": self.collection_name,
             "total_documents": self.collection.count(),
-            "persist_dir": str(self.persist_dir)
+            "persist_dir": str(self.persist_dir),
+            "index_type": type(self.index).__name__ if self.index is not None else None,
+            "index_vectors": self.index.ntotal if self.index is not None else 0,
+            "tail_vectors": len(self.tail_ids)
         }
 
 